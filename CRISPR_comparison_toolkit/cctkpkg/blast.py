@@ -5,6 +5,7 @@ import sys
 import os
 import argparse
 import subprocess
+import shlex
 import multiprocessing
 import re
 from collections import defaultdict
@@ -223,19 +224,18 @@ def blastn_to_arrays(args):
         No arrays found: If no arrays were found in the blast database
           then this raises an error stating that and exits.
     """ 
-    blastn_command = "blastn -query {} -db {} -task blastn-short -outfmt \
-    '6 std qlen slen sseq' -num_threads {} -max_target_seqs {} -evalue {} {}\
-    ".format(
-        args.repeats_file,
-        args.blast_db_path,
-        args.num_threads,
-        args.max_target_seqs,
-        args.evalue,
-        args.other_blast_options
-        )
+    blastn_command = [
+        "blastn",
+        "-query", args.repeats_file,
+        "-db", args.blast_db_path,
+        "-task", "blastn-short",
+        "-outfmt", "6 std qlen slen sseq",
+        "-num_threads", str(args.num_threads),
+        "-max_target_seqs", str(args.max_target_seqs),
+        "-evalue", str(args.evalue)
+        ] + shlex.split(args.other_blast_options)
     blast_run = subprocess.run(
         blastn_command,
-        shell=True,
         universal_newlines=True,
         capture_output=True
         )
@@ -244,19 +244,15 @@ def blastn_to_arrays(args):
         print("ERROR running blast on {}:\n{}".format(
             args.blast_db_path, blast_run.stderr))
         sys.exit()
-    blast_lines = [
-        file_handling.BlastResult(
-            i) for i in blast_run.stdout.split('\n') if len(i) > 0]
+    blast_lines = list(file_handling.parse_blast_output(
+        blast_run.stdout.splitlines()))
 
     queries_dict = file_handling.fasta_to_dict(args.repeats_file)
     # If blast result is < query length, extend it to check if it is
     # a good match and update pid by comparing to repeat sequence
 
     hits_to_update = []
-    fstring = ''
-    batch_locations = ''
-    extended_hits = []
-    n_args = 0
+    pool_input = [] # blastdbcmd query for each hit to extend
 
     for n, line in enumerate(blast_lines):
         if line.length == line.qlen:
@@ -273,42 +269,31 @@ def blastn_to_arrays(args):
             line.pident = 0
             continue
 
-        hits_to_update.append(n)
-        n_args+=3
-        if n_args > args.batch_size:
-            x = len(extended_hits)
-            extended_hits += sequence_operations.run_blastcmd(
-                [], # Only used for multithread running
-                args.blast_db_path,
-                fstring,
-                batch_locations
-                )[1]
-            fstring = ''
-            batch_locations = ''
-            n_args = 3
-
-        fstring += '%s %s %s\n'
         if line.sstart < line.send:
-            batch_locations += '{} {}-{} {} '.format(
+            batch_locations = '{} {}-{} {} '.format(
                 line.sseqid,
                 line.sstart,
                 line.send,
                 line.strand
                 )
         else:
-            batch_locations += '{} {}-{} {} '.format(
+            batch_locations = '{} {}-{} {} '.format(
                 line.sseqid,
                 line.send,
                 line.sstart,
                 line.strand
                 )
-    
-    extended_hits += sequence_operations.run_blastcmd(
-        [],
+        pool_input.append(
+            (len(hits_to_update), '%s %s %s\n', batch_locations))
+        hits_to_update.append(n)
+
+    # args.batch_size counts blastdbcmd arguments, 3 per hit
+    extended_hits = sequence_operations.pool_MP_blastdbcmd(
+        pool_input,
         args.blast_db_path,
-        fstring,
-        batch_locations
-        )[1]
+        max(args.batch_size//3, 1),
+        args.num_threads
+        )
 
     for n, new_seq in zip(hits_to_update, extended_hits):
         hit = blast_lines[n]
@@ -435,22 +420,21 @@ def which_substring_in_string(substrings, string):
 
 
 def check_repeat_similarity(repeats_file):
-    blastn_command = "blastn -query {} -subject {} -task blastn-short -outfmt \
-        '6 std qlen slen sseq'\
-        ".format(
-            repeats_file,
-            repeats_file,
-            )
+    blastn_command = [
+        "blastn",
+        "-query", repeats_file,
+        "-subject", repeats_file,
+        "-task", "blastn-short",
+        "-outfmt", "6 std qlen slen sseq"
+        ]
     blast_run = subprocess.run(
         blastn_command,
-        shell=True,
         universal_newlines=True,
         capture_output=True
         )
 
-    blast_lines = [
-        file_handling.BlastResult(
-        i) for i in blast_run.stdout.split('\n') if len(i) > 0]
+    blast_lines = file_handling.parse_blast_output(
+        blast_run.stdout.splitlines())
     similar_pairs = []
     for line in blast_lines:
         if (
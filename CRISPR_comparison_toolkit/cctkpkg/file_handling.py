@@ -178,26 +178,50 @@ class BlastResult():
         strand (str): Whether the blast hit was on the top (plus) or
           bottom (minus) strand of the DNA
     """
+    # Blast output can have millions of hits, so avoid a __dict__ each
+    __slots__ = (
+        'qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen',
+        'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore', 'qlen',
+        'slen', 'sseq', 'strand')
+
     def __init__(self, blast_line):
-        bits = blast_line.split('\t')
-        self.qseqid = bits[0]
-        self.sseqid = bits[1]
-        self.pident = float(bits[2])
-        self.length = int(bits[3])
-        self.mismatch = int(bits[4])
-        self.gapopen = bits[5]
-        self.qstart = int(bits[6])
-        self.qend = int(bits[7])
-        self.sstart = int(bits[8])
-        self.send = int(bits[9])
-        self.evalue = bits[10]
-        self.bitscore = bits[11]
-        self.qlen = int(bits[12])
-        self.slen = int(bits[13])
-        self.sseq = bits[14] if len(bits) == 15 else ''
+        (self.qseqid, self.sseqid, pident, length, mismatch, self.gapopen,
+            qstart, qend, sstart, send, self.evalue, self.bitscore, qlen,
+            slen, *sseq) = blast_line.rstrip('\n').split('\t', 14)
+        self.pident = float(pident)
+        self.length = int(length)
+        self.mismatch = int(mismatch)
+        self.qstart = int(qstart)
+        self.qend = int(qend)
+        self.sstart = int(sstart)
+        self.send = int(send)
+        self.qlen = int(qlen)
+        self.slen = int(slen)
+        self.sseq = sseq[0] if sseq else ''
         self.strand = 'plus' if self.sstart < self.send else 'minus'
 
 
+def parse_blast_output(lines):
+	"""Parse lines of tabular blast output into BlastResult instances.
+
+	Lines are parsed lazily so blast output can be processed as it is
+	read without keeping every hit in memory.
+
+	Args:
+	  lines (iterable of str):
+		Lines of blast output in the format '6 std qlen slen' with an
+		optional sseq column. Blank lines are skipped.
+
+	Yields:
+	  BlastResult:
+		The parsed contents of each line
+	"""
+	for line in lines:
+		line = line.rstrip('\n')
+		if line:
+			yield BlastResult(line)
+
+
 def read_array_file(file):
 	"""Read array spacers file into dict.
 	
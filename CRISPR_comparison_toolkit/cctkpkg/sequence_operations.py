@@ -3,9 +3,17 @@ import os
 import numpy as np
 from collections import defaultdict, Counter
 from itertools import combinations
+from functools import lru_cache
 import subprocess
 from copy import deepcopy
 import multiprocessing
+import threading
+
+try:
+	from numba import njit
+	_HAS_NUMBA = True
+except ImportError:
+	_HAS_NUMBA = False
 
 from . import (
 	file_handling
@@ -29,6 +37,42 @@ SEQUENCE_DICT = { # IUPAC DNA alphabet as regex
 	"V": "[ACG]"
 }
 
+# Complement table for rev_comp. Covers the IUPAC DNA alphabet in both
+# cases. Characters not in the table are left unchanged.
+_RC_TABLE = str.maketrans(
+	"ACGTRYKMSWBDHVNacgtrykmswbdhvn",
+	"TGCAYRMKSWVHDBNtgcayrmkswvhdbn")
+
+# Byte-level version of _RC_TABLE used by rev_comp for long sequences,
+# where indexing a numpy array beats str.translate.
+_RC_LUT = np.arange(256, dtype=np.uint8)
+for _base, _comp in _RC_TABLE.items():
+	_RC_LUT[_base] = _comp
+del _base, _comp
+
+# Sequences at least this long are reverse complemented with _RC_LUT
+_RC_NUMPY_MIN_LEN = 4096
+
+# Sequences shorter than this are compared by hamming in python, where
+# numpy's per-call overhead outweighs the faster comparison.
+_HAMMING_NUMPY_MIN_LEN = 48
+
+# Base codes used by encode_dna. Non-ACGT characters are moved into the
+# upper half of the byte range so they never equal a base code.
+_ENC_LUT = np.arange(256, dtype=np.uint8) | 0x80
+for _code, _base in enumerate("ACGT"):
+	_ENC_LUT[ord(_base)] = _code
+del _code, _base
+
+# Needleman-Wunsch traceback directions: diagonal (match/mismatch),
+# up (gap in seq2) and left (gap in seq1)
+_DIAG, _UP, _LEFT = 0, 1, 2
+
+# Per-thread buffers reused by needle and the largest alignment (in
+# grid cells) they will be grown to hold. See _nw_workspace.
+_NW_WORKSPACE = threading.local()
+_NW_WORKSPACE_MAX_CELLS = 2**22
+
 
 class NetworkEdge():
 	"""Class to store edge attributes in Network
@@ -62,6 +106,10 @@ class NetworkEdge():
 
 def rev_comp(string):
 	"""Reverse complement a string of nucleotide sequence
+
+	Results for sequences shorter than _RC_NUMPY_MIN_LEN (e.g., repeats
+	and spacers) are cached as the same sequences are reverse
+	complemented many times. Use clear_rev_comp_cache to empty it.
 	
 	Args:
 	  string (str):
@@ -79,23 +127,74 @@ def rev_comp(string):
 		raise TypeError(
 			"string must be str, not {}.".format(type(string).__name__))
 
-	rev_str = ''
-	rev_comp_lookup = {
-	"A" : "T", 
-	"T" : "A", 
-	"C" : "G", 
-	"G" : "C", 
-	"a" : "t", 
-	"t" : "a", 
-	"c" : "g", 
-	"g" : "c",
-	}
-	for i in reversed(string):
-		if i in "ATCGatcg":
-			rev_str += rev_comp_lookup[i]
-		else:
-			rev_str += i
-	return rev_str
+	if len(string) >= _RC_NUMPY_MIN_LEN and string.isascii():
+		arr = np.frombuffer(string.encode('ascii'), dtype=np.uint8)
+		return _RC_LUT[arr][::-1].tobytes().decode('ascii')
+
+	return _rev_comp_cached(string)
+
+
+@lru_cache(maxsize=131072)
+def _rev_comp_cached(string):
+	return string.translate(_RC_TABLE)[::-1]
+
+
+def clear_rev_comp_cache():
+	"""Empty the cache of sequences reverse complemented by rev_comp"""
+	_rev_comp_cached.cache_clear()
+
+
+def encode_dna(string):
+	"""Encode a nucleotide sequence as a numpy array of base codes
+	
+	A, C, G, and T are encoded as 0-3. Any other character is encoded
+	as its ASCII value with the high bit set so it can't be confused
+	with a base and only matches the same character.
+
+	Args:
+	  string (str):
+		Nucleotide sequence
+
+	Returns:
+	  numpy.ndarray:
+		uint8 array of base codes
+
+	Raises:
+	  UnicodeEncodeError: If string contains non-ASCII characters.
+	"""
+	return _ENC_LUT[np.frombuffer(string.encode('ascii'), dtype=np.uint8)]
+
+
+def _shifted_mismatches(a, b):
+	"""Count mismatched positions between two byte arrays.
+	
+	Positions beyond the end of the shorter array count as mismatches.
+	"""
+	n = min(len(a), len(b))
+	return int((a[:n] != b[:n]).sum()) + abs(len(a)-len(b))
+
+
+def hamming_encoded(a, b):
+	"""Calculate hamming distances between two encoded sequences.
+
+	Encoded equivalent of hamming for sequences that will be compared
+	many times and so can be encoded once with encode_dna.
+	
+	Args:
+	  a (numpy.ndarray):
+		First sequence to be compared as returned by encode_dna
+	  b (numpy.ndarray):
+		Second sequence to be compared as returned by encode_dna
+
+	Returns:
+	  tuple:
+		dist, distplus1, distminus1 as returned by hamming
+	"""
+	dist = _shifted_mismatches(a, b)
+	distplus1 = _shifted_mismatches(a[1:], b)
+	distminus1 = _shifted_mismatches(a, b[1:])
+
+	return dist, distplus1, distminus1
 
 
 def hamming(string1, string2):
@@ -129,36 +228,269 @@ def hamming(string1, string2):
 	if type(string2) is not str:
 		raise TypeError(
 			"Inputs must be str, not {}.".format(type(string2).__name__))
-	dist, distplus1, distminus1 = 0,0,0
-	string1plus1 = string1[1:]
-	string2plus1 = string2[1:]
-	for i in range(max(len(string1), len(string2))):
-		if i < len(string1) and i < len(string2):
-			if string1[i] != string2[i]:
-				dist += 1
-		else:
+
+	# Short or non-ASCII sequences can't use (or don't benefit from)
+	# the encoded comparison.
+	if (min(len(string1), len(string2)) < _HAMMING_NUMPY_MIN_LEN
+		or not string1.isascii() or not string2.isascii()):
+		return _hamming_python(string1, string2)
+
+	return hamming_encoded(encode_dna(string1), encode_dna(string2))
+
+
+def _hamming_python(s1, s2):
+	"""Single pass version of hamming used for short sequences
+	"""
+	l1 = len(s1)
+	l2 = len(s2)
+	l1plus1 = max(l1-1, 0)
+	l2plus1 = max(l2-1, 0)
+
+	# Positions beyond the end of the shorter sequence are mismatches
+	dist = abs(l1-l2)
+	distplus1 = abs(l1plus1-l2)
+	distminus1 = abs(l1-l2plus1)
+	for i in range(min(l1, l2)):
+		c1 = s1[i]
+		c2 = s2[i]
+		if c1 != c2:
 			dist += 1
-	
-	for i in range(max(len(string1plus1), len(string2))):
-		if i < len(string1plus1) and i < len(string2):
-			if string1plus1[i] != string2[i]:
-				distplus1 += 1
-		else:
+		if i < l1plus1 and s1[i+1] != c2:
 			distplus1 += 1
-	
-	for i in range(max(len(string1), len(string2plus1))):
-		if i < len(string1) and i < len(string2plus1):
-			if string1[i] != string2plus1[i]:
-				distminus1 += 1
-		else:
+		if i < l2plus1 and c1 != s2[i+1]:
 			distminus1 += 1
 
 	return dist, distplus1, distminus1
 
 
+def _needle_python(seq1, seq2, match, mismatch, gap):
+	"""Pure python Needleman-Wunsch used by needle if numba is missing
+	"""
+	# Make a grid with dimensions x by y, and a matching one to record
+	# which neighbouring cell each score came from. Every cell that is
+	# read is written first so they don't need to be zeroed.
+	grid, trace = _nw_workspace(len(seq2)+1, len(seq1)+1)
+
+	# Fill in grid with scores for all possible alignments
+	# First score for no alignment (i.e. all gaps)
+	for i in range(len(seq1)+1):
+		grid[0][i] = gap*i
+	for i in range(len(seq2)+1):
+		grid[i][0] = gap*i
+
+	# Then score for each cell if you came to it from the 
+	# nearest best cell. Each row is built in a python list from the
+	# previous row, with the match/mismatch scores for the whole row
+	# looked up at once by comparing the encoded sequences.
+	codes1, codes2 = _encode_items(seq1, seq2)
+	prev_row = grid[0].tolist()
+	for j in range(len(seq2)):
+		score_row = np.where(codes1 == codes2[j], match, mismatch).tolist()
+		row = [prev_row[0]+gap]
+		trace_row = [_LEFT]
+		for i in range(len(seq1)):
+			d = prev_row[i]+score_row[i]
+			u = row[i]+gap
+			l = prev_row[i+1]+gap
+			best = max(d, u, l)
+			row.append(best)
+			trace_row.append(_DIAG if best == d else _UP if best == u else _LEFT)
+		grid[j+1] = row
+		trace[j+1] = trace_row
+		prev_row = row
+
+	i = len(seq2)
+	j = len(seq1)
+
+	# Read back through the grid along the best path to create the
+	# best alignment
+	align1, align2 = [], []
+	# end when it reaches the top or the left edge
+	while i > 0 and j > 0:
+		# Move to the cell the current score was calculated from
+		direction = trace[i][j]
+		if direction == _DIAG:
+			align1.append(seq1[j-1])
+			align2.append(seq2[i-1])
+			i -= 1
+			j -= 1
+		elif direction == _UP:
+			align1.append(seq1[j-1])
+			align2.append('-')
+			j -= 1
+		else:
+			align1.append('-')
+			align2.append(seq2[i-1])
+			i -= 1
+
+	# Finish tracing up to the top left cell
+	while j > 0:
+		align1.append(seq1[j-1])
+		align2.append('-')
+		j -= 1
+	while i > 0:
+		align1.append('-')
+		align2.append(seq2[i-1])
+		i -= 1
+	
+	# Since we traversed the score matrix backwards, need to
+	# reverse alignments.
+	return align1[::-1], align2[::-1]
+
+
+def _nw_workspace(rows, cols):
+	"""Get score and direction matrices for a Needleman-Wunsch alignment
+	
+	needle is called many times on short sequences, so the matrices are
+	views of buffers that are kept and reused by each thread, growing
+	them as needed. Alignments too large to keep buffers for get new
+	arrays. The contents of the returned matrices are undefined.
+
+	Args:
+	  rows (int):
+		Number of rows needed
+	  cols (int):
+		Number of columns needed
+
+	Returns:
+	  tuple:
+		grid (numpy.ndarray):
+		  int32 matrix of shape (rows, cols) for scores
+		trace (numpy.ndarray):
+		  int8 matrix of shape (rows, cols) for traceback directions
+	"""
+	if rows * cols > _NW_WORKSPACE_MAX_CELLS:
+		return (np.empty((rows, cols), dtype=np.int32),
+			np.empty((rows, cols), dtype=np.int8))
+
+	grid = getattr(_NW_WORKSPACE, "grid", None)
+	if grid is None or grid.shape[0] < rows or grid.shape[1] < cols:
+		shape = (max(rows, 256), max(cols, 256))
+		if grid is not None:
+			shape = (max(shape[0], grid.shape[0]), max(shape[1], grid.shape[1]))
+		# Growing each dimension separately can make a buffer much
+		# larger than any single alignment. Don't exceed the limit.
+		if shape[0] * shape[1] > _NW_WORKSPACE_MAX_CELLS:
+			shape = (rows, cols)
+		_NW_WORKSPACE.grid = np.empty(shape, dtype=np.int32)
+		_NW_WORKSPACE.trace = np.empty(shape, dtype=np.int8)
+
+	return (_NW_WORKSPACE.grid[:rows, :cols],
+		_NW_WORKSPACE.trace[:rows, :cols])
+
+
+def _encode_items(seq1, seq2):
+	"""Encode the items of two sequences as integer codes
+	
+	Equal items are given the same code in both sequences so the
+	sequences can be compared as numpy arrays or in numba-compiled
+	functions.
+	"""
+	codes = {}
+	codes1 = np.array(
+		[codes.setdefault(item, len(codes)) for item in seq1], dtype=np.int64)
+	codes2 = np.array(
+		[codes.setdefault(item, len(codes)) for item in seq2], dtype=np.int64)
+	return codes1, codes2
+
+
+def _needle_numba(seq1, seq2, match, mismatch, gap):
+	"""Needleman-Wunsch using the numba-compiled fill and traceback
+	"""
+	codes1, codes2 = _encode_items(seq1, seq2)
+	grid, trace = _nw_workspace(len(seq2)+1, len(seq1)+1)
+	_nw_fill(codes1, codes2, match, mismatch, gap, grid, trace)
+	idx1, idx2 = _nw_traceback(trace)
+
+	align1 = [seq1[k] if k >= 0 else '-' for k in idx1]
+	align2 = [seq2[k] if k >= 0 else '-' for k in idx2]
+
+	return align1, align2
+
+
+if _HAS_NUMBA:
+	@njit(cache=True)
+	def _nw_fill(s1, s2, match, mismatch, gap, grid, trace):
+		"""Fill the Needleman-Wunsch score grid for two encoded sequences
+		
+		grid and trace are filled in place. trace records the cell each
+		score came from.
+		"""
+		for i in range(len(s1)+1):
+			grid[0, i] = gap*i
+		for i in range(len(s2)+1):
+			grid[i, 0] = gap*i
+
+		# Rows (j) outer so the inner loop walks along contiguous rows
+		for j in range(len(s2)):
+			for i in range(len(s1)):
+				if s1[i] == s2[j]:
+					score = match
+				else:
+					score = mismatch
+				d = grid[j, i]+score
+				u = grid[j+1, i]+gap
+				l = grid[j, i+1]+gap
+				if d >= u and d >= l:
+					grid[j+1, i+1] = d
+					trace[j+1, i+1] = _DIAG
+				elif u >= l:
+					grid[j+1, i+1] = u
+					trace[j+1, i+1] = _UP
+				else:
+					grid[j+1, i+1] = l
+					trace[j+1, i+1] = _LEFT
+
+
+	@njit(cache=True)
+	def _nw_traceback(trace):
+		"""Follow a direction matrix back along the best path
+		
+		Returns the indices of the aligned items of each sequence in
+		alignment order with -1 marking a gap.
+		"""
+		i = trace.shape[0] - 1
+		j = trace.shape[1] - 1
+		n = i + j
+		align1 = np.empty(n, dtype=np.int64)
+		align2 = np.empty(n, dtype=np.int64)
+		k = n
+		while i > 0 and j > 0:
+			k -= 1
+			direction = trace[i, j]
+			if direction == _DIAG:
+				align1[k] = j-1
+				align2[k] = i-1
+				i -= 1
+				j -= 1
+			elif direction == _UP:
+				align1[k] = j-1
+				align2[k] = -1
+				j -= 1
+			else:
+				align1[k] = -1
+				align2[k] = i-1
+				i -= 1
+
+		while j > 0:
+			k -= 1
+			align1[k] = j-1
+			align2[k] = -1
+			j -= 1
+		while i > 0:
+			k -= 1
+			align1[k] = -1
+			align2[k] = i-1
+			i -= 1
+
+		return align1[k:], align2[k:]
+
+
 def needle(seq1, seq2, match = 100, mismatch = -1, gap = -2):
 	"""
 	Perform Needleman-Wunsch pairwise alignment of two sequences.
+	Scores are stored as int32 so float match, mismatch, and gap
+	scores are truncated to int.
 	Args:
 	  seq1 (str, list, or tuple):
 		First sequence of items to align.
@@ -204,77 +536,12 @@ def needle(seq1, seq2, match = 100, mismatch = -1, gap = -2):
 			"gap must be int or float, not {}.".format(
 				type(gap).__name__))
 
+	match, mismatch, gap = int(match), int(mismatch), int(gap)
 
-	# Make a list of lists of 0s with dimensions x by y: 
-	# list containing x lists of y 0s each.
-	grid = np.zeros((len(seq2)+1, len(seq1)+1))
-
-	# Fill in grid with scores for all possible alignments
-	# First score for no alignment (i.e. all gaps)
-	for i in range(len(seq1)+1):
-		grid[0][i] = gap*i
-	for i in range(len(seq2)+1):
-		grid[i][0] = gap*i
-
-	# Then score for each cell if you came to it from the 
-	# nearest best cell
-	for i in range(len(seq1)):
-		for j in range(len(seq2)):
-			if seq1[i] == seq2[j]:
-				score = match
-			else:
-				score = mismatch
-			grid[j+1][i+1] = max([grid[j][i]+score,
-				grid[j+1][i]+gap,
-				grid[j][i+1]+gap])
-
-	i = len(seq2)
-	j = len(seq1)
-
-	# Read back through the grid along the best path to create the
-	# best alignment
-	align1, align2 = [], []
-	# end when it reaches the top or the left edge
-	while i > 0 and j > 0:
-		score_current = grid[i][j]
-		score_diagonal = grid[i-1][j-1]
-		score_up = grid[i][j-1]
-		score_left = grid[i-1][j]
-		if seq1[j-1] == seq2[i-1]:
-			score = match
-		else:
-			score = mismatch
-		# Check to figure out which cell the current score was 
-		# calculated from, then update i and j to correspond to
-		# that cell.
-		if score_current == score_diagonal + score:
-			align1.append(seq1[j-1])
-			align2.append(seq2[i-1])
-			i -= 1
-			j -= 1
-		elif score_current == score_up + gap:
-			align1.append(seq1[j-1])
-			align2.append('-')
-			j -= 1
-		elif score_current == score_left + gap:
-			align1.append('-')
-			align2.append(seq2[i-1])
-			i -= 1
-
-	# Finish tracing up to the top left cell
-	while j > 0:
-		align1.append(seq1[j-1])
-		align2.append('-')
-		j -= 1
-	while i > 0:
-		align1.append('-')
-		align2.append(seq2[i-1])
-		i -= 1
-	
-	# Since we traversed the score matrix backwards, need to
-	# reverse alignments.
-	align1 = align1[::-1]
-	align2 = align2[::-1]
+	if _HAS_NUMBA:
+		align1, align2 = _needle_numba(seq1, seq2, match, mismatch, gap)
+	else:
+		align1, align2 = _needle_python(seq1, seq2, match, mismatch, gap)
 
 	if isinstance(seq1, str) and isinstance(seq2, str):
 		align1 = ''.join(align1)
@@ -291,14 +558,12 @@ def find_indices(lst, element):
 	e.g. for a list ['apple', 'tomatoe', 'apple', 'banana']
 	Returns [0,2] for 'apple'
 
-	lst.index() only returns the first instance by default. 
-	The second argument provided to index is the position to start
-	searching. This approach starts looking again from the index after
-	the last found index.
+	If lst is a str, the start positions of all (possibly overlapping)
+	occurrences of the substring element are returned.
 
 
 	Args:
-	  lst (list): 
+	  lst (list, tuple, str, or numpy array): 
 		a list of anything
 	  element (any type):
 		An element you expect to find in the list
@@ -308,14 +573,18 @@ def find_indices(lst, element):
 		A list of indices at which the element was found in the list.
 		Returns an empty list if no indices were found.
 	"""
-	result = []
-	offset = -1
-	while True:
-		try:
-			offset = lst.index(element, offset+1) 
-		except ValueError:
-			return result
-		result.append(offset)
+	if isinstance(lst, str):
+		result = []
+		offset = lst.find(element)
+		while offset != -1:
+			result.append(offset)
+			offset = lst.find(element, offset+1)
+		return result
+
+	if isinstance(lst, np.ndarray):
+		return np.flatnonzero(lst == element).tolist()
+
+	return [i for i, v in enumerate(lst) if v == element]
 
 
 def get_repeat_info(CRISPR_types_dict, repeat):
@@ -347,6 +616,7 @@ def get_repeat_info(CRISPR_types_dict, repeat):
 	best_score = 1000
 	best_match = ''
 	reverse = False
+	rev_repeat = rev_comp(repeat)
 	for k,v in CRISPR_types_dict.items():
 		score = min(hamming(repeat, v))
 		if score < best_score:
@@ -354,8 +624,7 @@ def get_repeat_info(CRISPR_types_dict, repeat):
 			best_match = k
 			reverse = False
 
-		score = min(hamming(
-			rev_comp(repeat), v))
+		score = min(hamming(rev_repeat, v))
 		if score < best_score:
 			best_score = score
 			best_match = k
@@ -572,11 +841,15 @@ def pool_MP_blastdbcmd(inputs, db, batch_size, threads):
 	Returns:
 		(list) List of FoundArray instances representing distinct arrays
 	"""
+	if len(inputs) == 0:
+		return []
+
 	pool = multiprocessing.Pool(processes=threads)
 
-	batch_size = min(batch_size, len(inputs)//threads)
+	# With fewer inputs than threads, still use batches of at least 1
+	batch_size = max(min(batch_size, len(inputs)//threads), 1)
 
-	chunksize = int((len(inputs)/batch_size)//threads)
+	chunksize = max(int((len(inputs)/batch_size)//threads), 1)
 
 	batches = []
 	for i in range(0, len(inputs), batch_size):
@@ -606,17 +879,19 @@ def pool_MP_blastdbcmd(inputs, db, batch_size, threads):
 
 def run_blastcmd(ns, db, fstring, batch_locations):
 	"""
-	function to call blastdbcmd in a shell and process the output. Uses
-	a batch query of the format provided in the blastdbcmd docs. e.g.
-	printf "%s %s %s %s\\n%s %s %s\\n" 13626247 40-80 plus 30 14772189 \
-	1-10 minus | blastdbcmd -db GPIPE/9606/current/all_contig \
-	-entry_batch -
+	function to call blastdbcmd and process the output. Uses a batch
+	query of the format provided in the blastdbcmd docs, written to
+	blastdbcmd's stdin. e.g. for fstring "%s %s %s\\n%s %s %s\\n" and
+	batch_locations "13626247 40-80 plus 14772189 1-10 minus" the
+	batch query is:
+	13626247 40-80 plus
+	14772189 1-10 minus
 	
 	Args:
 		ns (list): indices to reorder the output from this func when
 		  running on multiple threads
 		db (str): path to the blast db you want to query.
-		fstring (str):  The string to give to printf
+		fstring (str):  printf-style format of the batch query
 		batch_locations (str):  the seqid, locations, and strand of all
 		  the spacers to be retrieved
 	
@@ -630,9 +905,8 @@ def run_blastcmd(ns, db, fstring, batch_locations):
 		  information provided to blastdbcmd and aborts the process.
 	"""
 	x = subprocess.run(
-		'printf "{}" {}| blastdbcmd -db {} -entry_batch -\
-			'.format(fstring, batch_locations, db), 
-		shell=True,
+		["blastdbcmd", "-db", db, "-entry_batch", "-"],
+		input=fstring % tuple(batch_locations.split()),
 		universal_newlines=True,
 		capture_output=True
 		) 
@@ -641,8 +915,10 @@ def run_blastcmd(ns, db, fstring, batch_locations):
 			db, batch_locations, x.stderr))
 		sys.exit()
 	else:
+		# Keep as a list as the output is pickled to return it from
+		# worker processes.
 		return (ns, 
-			[i for i in x.stdout.split('\n') if '>' not in i and len(i) > 0])
+			[i for i in x.stdout.splitlines() if i and i[0] != '>'])
 
 
 def determine_regex_length(pattern):
@@ -803,9 +1079,8 @@ def make_spacer_snp_network(spacer_fasta_dict, snp_thresh, outdir):
 			sys.stderr.write("ERROR running blast to dereplicate spacers:\n\n")
 			sys.stderr.write(blast_run.stderr)
 			sys.exit()
-		blast_lines = [
-			file_handling.BlastResult(
-				i) for i in blast_run.stdout.split('\n') if len(i) > 0]
+		blast_lines = file_handling.parse_blast_output(
+			blast_run.stdout.splitlines())
 
 		for hit in blast_lines:
 			if hit.mismatch > snp_thresh:
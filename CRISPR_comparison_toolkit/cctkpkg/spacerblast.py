@@ -4,6 +4,8 @@
 import sys
 import argparse
 import subprocess
+import shlex
+import tempfile
 import re
 from copy import copy
 from collections import defaultdict
@@ -112,32 +114,46 @@ def run_blastn(args):
 		  user.
 
 	
-	Returns:
-		(list):  List of lines of a blast output file.
+	Yields:
+		(BlastResult):  Each line of the blast output as it is produced
+		  by blastn.
 	
 	Raises:
-		ERROR running blast.
+		ERROR running blast: Checked once blastn has finished.
 	"""	
-	blastn_command = "blastn -query {} -db {} -task blastn-short \
-	-outfmt '6 std qlen slen' -num_threads {} -max_target_seqs {} -evalue {} \
-	{}".format(args.spacer_file,
-		args.blast_db_path,
-		args.num_threads,
-		args.max_target_seqs,
-		args.evalue,
-		args.other_blast_options)
-	blast_run = subprocess.run(blastn_command,
-		shell=True,
-		universal_newlines=True,
-		capture_output=True)
-	if blast_run.stderr:
+	blastn_command = [
+		"blastn",
+		"-query", args.spacer_file,
+		"-db", args.blast_db_path,
+		"-task", "blastn-short",
+		"-outfmt", "6 std qlen slen",
+		"-num_threads", str(args.num_threads),
+		"-max_target_seqs", str(args.max_target_seqs),
+		"-evalue", str(args.evalue)
+		] + shlex.split(args.other_blast_options)
+	# stderr goes to a temporary file so a chatty blastn can't fill
+	# the pipe and stall while stdout is being read.
+	with tempfile.TemporaryFile(mode='w+') as stderr_file:
+		blast_run = subprocess.Popen(blastn_command,
+			universal_newlines=True,
+			stdout=subprocess.PIPE,
+			stderr=stderr_file)
+		finished = False
+		try:
+			with blast_run.stdout:
+				yield from file_handling.parse_blast_output(blast_run.stdout)
+			finished = True
+		finally:
+			# Don't leave blastn running if the caller stopped early
+			if not finished:
+				blast_run.kill()
+			blast_run.wait()
+		stderr_file.seek(0)
+		blast_stderr = stderr_file.read()
+	if blast_stderr:
 		print("ERROR running blast on {}:\n{}".format(
-			args.blast_db_path, blast_run.stderr))
+			args.blast_db_path, blast_stderr))
 		sys.exit()
-	blast_lines = [
-		file_handling.BlastResult(
-			i) for i in blast_run.stdout.split('\n') if len(i) > 0]
-	return blast_lines
 
 
 def fill_initial_info(result, flanking_n):